@@ -0,0 +1,16 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Provides numpy helpers missing from some of the supported numpy versions."""
+
+import numpy as np
+
+def ids_in(ids, reference_ids):
+    """
+    Returns a boolean mask of which ids are also in reference_ids.
+    Same as np.isin, which isn't available on NumPy 1.12 (while np.in1d was removed by NumPy 2).
+    """
+    if not len(reference_ids):
+        return np.zeros(len(ids), dtype=bool)
+    reference_ids = np.sort(reference_ids)
+    positions = np.minimum(np.searchsorted(reference_ids, ids), len(reference_ids) - 1)
+    return reference_ids[positions] == ids
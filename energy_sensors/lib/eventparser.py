@@ -2,6 +2,7 @@
 # -*- coding: utf-8 -*-
 """Provides facilities for parsing a custom format."""
 
+import functools
 import re
 import dateutil.parser
 
@@ -10,33 +11,130 @@ _RE_KNOWN_SUFFIXES = re.compile(r'^([+-]?\d+[\.|,]?\d*)(v|var|va|w|rad)?$', re.I
 class EventParseError(Exception):
     pass
 
-def parse_event_to_dict(event_entry):
-    """Returns a hierarchy of dictionaries containing attributes extracted from event_entry."""
+class ParseCache(object):
+    """
+    Bounded LRU caches meant to be shared by `parse_event_to_dict` calls for consecutive events.
+    Events from the same sensor repeat most sections verbatim (e.g. `Alarms: CoilRevesed=OFF;`),
+    so sections are cached by their raw text, skipping both tokenization and decoding. Sections
+    that aren't cached still benefit from the cache of decoded values.
+    Cached results are immutable, a new dictionary or list being built for each parsed event.
+    """
+
+    def __init__(self, max_sections=256, max_values=1024):
+        self.decode_value = functools.lru_cache(maxsize=max_values)(_decode_value)
+        self.parse_section = functools.lru_cache(maxsize=max_sections)(
+            lambda section_str: _parse_frozen_section(section_str, self.decode_value))
+
+    def section_info(self):
+        """Returns hits, misses, maximum and current size of the section cache."""
+        return self.parse_section.cache_info()
+
+    def value_info(self):
+        """Returns hits, misses, maximum and current size of the decoded value cache."""
+        return self.decode_value.cache_info()
+
+    def clear(self):
+        """Removes all entries and resets the counters of both caches."""
+        self.parse_section.cache_clear()
+        self.decode_value.cache_clear()
+
+def parse_event_to_dict(event_entry, cache=None):
+    """
+    Returns a hierarchy of dictionaries containing attributes extracted from event_entry.
+    If a ParseCache is given, previously parsed sections and values are reused.
+    """
     objs = {}
     idx = 0
+    decode = cache.decode_value if cache else _decode_value
     while idx < len(event_entry):
+        idx = _skip_whitespaces(event_entry, idx)
+        if cache:
+            section_end = _find_section_end(event_entry, idx)
+            cached = _try_cached_section(cache, event_entry[idx:section_end])
+            if cached:
+                section, is_array, items = cached
+                objs[section] = list(items) if is_array else dict(items)
+                idx = section_end
+                continue
+
         section, idx = _read_section(event_entry, idx)
         if not section:
             break
-        objs[section] = {}
-
-        # attempt to parse array of elements
-        attr_values, idx = _read_array_elements(event_entry, idx)
-        if attr_values:
-            objs[section] = attr_values
-            continue
-
-        # attempt to parse key-value pairs
-        while idx < len(event_entry):
-            key, val, idx = _read_key_value(event_entry, idx)
-            if not key or val is None:
-                break
-            objs[section][key] = val
-
-        if not objs[section]:
-            raise EventParseError('Expected either a list of key-value pairs or list of elements.')
+        objs[section], idx = _read_section_values(event_entry, idx, decode)
     return objs
 
+def parse_events(event_entries, cache=None):
+    """
+    Parses an iterable of events, yielding one dictionary per event.
+    Consecutive events share a ParseCache, which is created if none is given.
+    """
+    cache = cache or ParseCache()
+    for event_entry in event_entries:
+        yield parse_event_to_dict(event_entry, cache)
+
+def _read_section_values(string, start, decode):
+    """Returns either the list of elements or the dictionary of key-value pairs of a section."""
+    # attempt to parse array of elements
+    attr_values, idx = _read_array_elements(string, start, decode)
+    if attr_values:
+        return attr_values, idx
+
+    # attempt to parse key-value pairs
+    attrs = {}
+    while idx < len(string):
+        key, val, idx = _read_key_value(string, idx, decode)
+        if not key or val is None:
+            break
+        attrs[key] = val
+
+    if not attrs:
+        raise EventParseError('Expected either a list of key-value pairs or list of elements.')
+    return attrs, idx
+
+def _find_section_end(string, start):
+    """
+    Returns where the section beginning at start is expected to end: right after the ';' that
+    precedes the next section declaration, or the end of the string. Parsing always stops at a
+    section declaration, so a section followed by one is parsed the same way as it would be alone.
+    """
+    colon = string.find(':', start)
+    if colon < 0:
+        return len(string)
+    # the first value of a section may contain ':' (e.g. time), so the search begins after it
+    sep = string.find(';', colon)
+    while sep >= 0:
+        next_sep = string.find(';', sep + 1)
+        chunk = string[sep + 1:next_sep if next_sep >= 0 else len(string)]
+        name, has_colon, _ = chunk.partition(':')
+        if has_colon and name.strip() and '=' not in name:
+            return sep + 1
+        sep = next_sep
+    return len(string)
+
+def _try_cached_section(cache, section_str):
+    """Returns the cached (section, is_array, items) tuple for section_str, or None."""
+    try:
+        section, is_array, items, parsed_len = cache.parse_section(section_str)
+    except EventParseError:
+        return None
+    # sections followed by unparseable data must be handled by the regular parser
+    if not section or parsed_len != len(section_str):
+        return None
+    return section, is_array, items
+
+def _parse_frozen_section(section_str, decode):
+    """
+    Parses a single section, returning its name, whether it's an array, a tuple of its items
+    (values or key-value pairs) and the parsed length.
+    """
+    section, idx = _read_section(section_str, _skip_whitespaces(section_str, 0))
+    if not section:
+        return None, False, (), 0
+    values, idx = _read_section_values(section_str, idx, decode)
+    if isinstance(values, list):
+        return section, True, tuple(values), idx
+    return section, False, tuple(values.items()), idx
+
 def _skip_whitespaces(string, start):
     while start < len(string) and string[start] == ' ':
         start += 1
@@ -56,7 +154,7 @@ def _read_section(string, start):
         idx += 1
     return (None, start)
 
-def _read_key_value(string, start):
+def _read_key_value(string, start, decode):
     start = _skip_whitespaces(string, start)
     idx = start
     key, val_str = None, None
@@ -88,12 +186,12 @@ def _read_key_value(string, start):
                 val_str = string[val_start:idx]
             else:
                 val_str = string[val_start:idx + 1]
-            return (key, _decode_value(val_str), idx + 1)
+            return (key, decode(val_str), idx + 1)
         idx += 1
 
     return (None, None, start)
 
-def _read_array_elements(string, start):
+def _read_array_elements(string, start, decode):
     start = _skip_whitespaces(string, start)
     idx = start
     elements = []
@@ -114,7 +212,7 @@ def _read_array_elements(string, start):
             else:
                 val_str = string[start:idx + 1].strip()
             start = idx + 1
-            elements.append(_decode_value(val_str))
+            elements.append(decode(val_str))
             # if at least one element is read, no further ':' are allowed inside array values
             list_term.add(':')
         idx += 1
@@ -0,0 +1,20 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Provides advisory file locks, shared by all processes on the same host."""
+
+import fcntl
+
+def try_lock(path):
+    """
+    Attempts to acquire an exclusive lock on the file at path, without blocking.
+    Returns:
+        The locked file object if succesful, None if the lock is held elsewhere. The lock is
+        released by closing the returned file, or automatically if the process dies.
+    """
+    lock_file = open(path, 'a')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        return None
+    return lock_file
@@ -5,64 +5,161 @@
 
 import threading
 import logging
-from energy_sensors.logservice.db import Cluster, get_db_sessionmaker, EventLog, EventCluster
-from sklearn.cluster import MeanShift, estimate_bandwidth
+from sqlalchemy import func
+from energy_sensors.lib.arrayutils import ids_in
+from energy_sensors.lib.filelock import try_lock
+from energy_sensors.logservice.db import Cluster, EventLog, EventCluster, ShardRouter, \
+                                        get_last_clustered_event_id, set_last_clustered_event_id, \
+                                        shard_of_event_id, SHARD_ID_STRIDE
+from energy_sensors.logservice.harmonics import HARMONIC_FEATURES, extract_harmonic_features, \
+                                               harmonic_feature_count, parse_harmonics_matrix
 import numpy as np
 
+# number of base features per event: 5 power/line attributes, followed by the first 3 transients
+BASE_FEATURE_COUNT = 8
+# columns of archived segments that map directly to the first clustering features
+_ARCHIVED_FEATURE_COLUMNS = ['power_active_w', 'power_reactive_var', 'power_apparent_va',
+                             'line_current_a', 'line_voltage_v']
+
 class ClusteringBatchWorker(object):
     """"
     Triggers clustering computations when a target event count is reached.
-    This class provides only one "public" event `report_event_received`, which should can be called
-    to increment the current count. When the batch size is reached, a new worker thread is spawned
-    and will run the entire workflow for refreshing cluster data on the database. This prevents
-    high-latency for users, as the main thread won't need to stop serving until the computation is
-    finished.
+    This class provides only one "public" event `report_event_received`, which should be called
+    with the id of each stored event. When the id is at least `batch_size` past the newest event
+    included in the last clustering run (the high-water mark, stored on the database), a new worker
+    thread is spawned and will run the entire workflow for refreshing cluster data on the database.
+    This prevents high-latency for users, as the main thread won't need to stop serving until the
+    computation is finished.
+
+    Since both the high-water mark and the lock file at `lock_path` are shared by every process on
+    the host, multiple logservice workers can report events, but only one clustering runs at a time.
+
+    Events are read through `router`, normally the one the service stores events with. If events
+    are sharded (see ShardRouter), each shard has its own high-water mark, and a computation is
+    triggered when any shard has `batch_size / shard_count` new events. Events are loaded from all
+    shards in parallel.
 
     KNOWN ISSUE: sklearn doesn't support multiprocessing-backed parallelism if ran outside the main
     thread. As a result of this, only the worker thread will be used to run the computation.
     A proper fix might be splitting the log and clustering services into two separate entities.
+
+    If an EventArchive is given and `history_days` is positive, the events of the most recent
+    `history_days` archived days are also included in the computation, read from memory-mapped
+    archive segments. Archived events are only used for fitting and cluster statistics, so they
+    never get `event_cluster` rows.
+
+    Features extracted from the first `harmonic_count` FFT harmonics can be appended to the base
+    features by listing their names (see HARMONIC_FEATURES) in `harmonic_features`.
     """
 
-    def __init__(self, batch_size=1000):
+    def __init__(self, batch_size=1000, archive=None, harmonic_features=(), harmonic_count=9,
+                 lock_path='logservice.clustering.lock', router=None, history_days=0):
+        unknown_features = set(harmonic_features) - set(HARMONIC_FEATURES)
+        if unknown_features:
+            raise ValueError('Unknown harmonic features: {}'.format(sorted(unknown_features)))
         self.running = False
         self.batch_size = batch_size
-        self.count = 0
+        self.archive = archive
+        self.history_days = history_days
+        self.harmonic_features = tuple(harmonic_features)
+        self.harmonic_count = harmonic_count
+        self.feature_count = BASE_FEATURE_COUNT + harmonic_feature_count(harmonic_features,
+                                                                         harmonic_count)
+        self.lock_path = lock_path
+        self.router = router or ShardRouter()
+        self.shard_batch_size = max(1, batch_size // self.router.shard_count)
+        # cached high-water marks of each shard, only refreshed when a batch seems complete
+        self.last_clustered_ids = {}
         self.worker_thread = None
 
-    def report_event_received(self):
-        """Reports new events, triggering the computation if the target count is reached."""
-        self.count += 1
-        if self.count >= self.batch_size:
-            self.count = 0
-            if self.worker_thread and self.worker_thread.is_alive():
-                logging.warning('Previous computation isn\'t finished, but a new batch was formed')
-                self.worker_thread.join()
-            self.worker_thread = threading.Thread(target=self._compute_clusters)
-            self.worker_thread.start()
-
-    def _compute_clusters(self):
-        """Triggers a new computation for the dataset."""
-        session = get_db_sessionmaker(debug=False)()
-        all_events = session.query(EventLog).all()
-        dataset = self._collect_dataset(all_events)
+    def report_event_received(self, event_id):
+        """Reports a new event, triggering the computation if the target count is reached."""
+        shard = shard_of_event_id(event_id)
+        last_clustered_id = self.last_clustered_ids.get(shard)
+        if last_clustered_id is not None and \
+           event_id - last_clustered_id < self.shard_batch_size:
+            return
+        # other processes may have clustered since the cached mark was read
+        session = self.router.sessionmakers[0]()
+        last_clustered_id = get_last_clustered_event_id(session, shard)
+        session.close()
+        self.last_clustered_ids[shard] = last_clustered_id
+        if event_id - last_clustered_id < self.shard_batch_size:
+            return
+
+        lock_file = try_lock(self.lock_path)
+        if lock_file is None:
+            # the cached mark is kept, so the next event checks again in case the run holding the
+            # lock finished without including this batch
+            logging.info('Clustering is already running elsewhere, skipping batch.')
+            return
+        # this process won't check again until another batch is formed
+        self.last_clustered_ids[shard] = event_id
+        self.worker_thread = threading.Thread(target=self._run_locked, args=(lock_file,))
+        self.worker_thread.start()
+
+    def _run_locked(self, lock_file):
+        """
+        Runs computations while a batch is pending, releasing the clustering lock when finished.
+        Batches formed during a run are reported while the lock is held, so they're only clustered
+        if checked again before releasing it.
+        """
+        session = self.router.sessionmakers[0]()
+        try:
+            # the batch might have been clustered by another process before the lock was acquired
+            while self._batch_pending(session):
+                if not self._compute_clusters(session):
+                    break
+        finally:
+            session.close()
+            lock_file.close()
+
+    def _batch_pending(self, session):
+        """Returns whether any shard has at least a batch of events past its high-water mark."""
+        max_event_ids = self.router.scatter(lambda s: s.query(func.max(EventLog.id)).scalar())
+        for shard, max_event_id in enumerate(max_event_ids):
+            last_clustered_id = get_last_clustered_event_id(session, shard)
+            if max_event_id and max_event_id - last_clustered_id >= self.shard_batch_size:
+                return True
+        return False
+
+    def _compute_clusters(self, session):
+        """Triggers a new computation for the dataset, returning whether it was successful."""
+        shard_events = self.router.scatter(lambda s: s.query(EventLog).all())
+        all_events = [event for events in shard_events for event in events]
+        event_ids = np.array([e.id for e in all_events], dtype=np.int64)
+        dataset = self._collect_dataset(all_events).reshape(-1, BASE_FEATURE_COUNT)
+        if self.harmonic_features:
+            harmonics = parse_harmonics_matrix([e.fft_harmonics for e in all_events])
+            dataset = np.hstack([dataset, self._extract_harmonic_features(harmonics)])
+        if self.archive is not None and self.history_days > 0:
+            archived_ids, archived_dataset = self._collect_archived_dataset()
+            # events compacted after the database was read are found on both, so they're dropped
+            archived_rows = ~ids_in(archived_ids, event_ids)
+            # archived rows come first, so database events are always the last ones
+            dataset = np.concatenate([archived_dataset[archived_rows], dataset])
 
         # runs the mean shift algorithm on the collected dataset
         mean_shift = self._run_mean_shift(dataset)
         if mean_shift is None:
             logging.error('Cluster computation failed!')
-            return
+            return False
 
         # calculates cluster statists related to event fit
-        cluster_stats = self._calculate_cluster_stats(all_events, mean_shift)
+        cluster_stats = self._calculate_cluster_stats(dataset, mean_shift)
         if not cluster_stats:
             logging.error('Cluster statistics computation failed!')
-            return
+            return False
 
         # if all calculations were sucessful, refresh database
-        self._update_cluster_storage(session, all_events, mean_shift, cluster_stats)
+        event_labels = mean_shift.labels_[len(dataset) - len(event_ids):]
+        self._update_cluster_storage(session, event_ids, event_labels, cluster_stats)
+        return True
 
     def _run_mean_shift(self, data):
         """Runs the mean shift algorithm on desired dataset."""
+        # sklearn (and scipy) take seconds to import, so they're only loaded by the first run
+        from sklearn.cluster import MeanShift, estimate_bandwidth
         bandwidth = estimate_bandwidth(data, quantile=0.2, n_samples=200)
         ms = MeanShift(bandwidth=bandwidth, cluster_all=False, bin_seeding=True)
         ms.fit_predict(data)
@@ -91,43 +188,67 @@ class ClusteringBatchWorker(object):
         feature_array.shape = [sample_count, feature_count]
         return feature_array
 
-    def _calculate_cluster_stats(self, events, mean_shift):
+    def _collect_archived_dataset(self):
+        """Returns event ids and the clustering features for the events of recent archived days."""
+        segments = self.archive.load_mapped_segments(self.history_days)
+        if not segments:
+            return np.empty(0, dtype=np.int64), np.empty((0, self.feature_count))
+        event_ids = np.concatenate([s['id'] for s in segments])
+        # columns are copied straight from the mapped segments into the final feature matrix
+        dataset = np.empty((len(event_ids), self.feature_count))
+        row = 0
+        for segment in segments:
+            rows = slice(row, row + len(segment['id']))
+            for col, column in enumerate(_ARCHIVED_FEATURE_COLUMNS):
+                dataset[rows, col] = segment[column]
+            dataset[rows, len(_ARCHIVED_FEATURE_COLUMNS):BASE_FEATURE_COUNT] = \
+                segment['current_peaks'][:, :3]
+            if self.harmonic_features:
+                dataset[rows, BASE_FEATURE_COUNT:] = \
+                    self._extract_harmonic_features(segment['harmonics'])
+            row = rows.stop
+        return event_ids, dataset
+
+    def _extract_harmonic_features(self, harmonics):
+        """Returns the selected harmonic features for a matrix of harmonics."""
+        return extract_harmonic_features(harmonics, self.harmonic_features, self.harmonic_count)
+
+    def _calculate_cluster_stats(self, dataset, mean_shift):
         """Returns a dictionary associating each cluster label with it's elements' statistics."""
-        # NOTE: is there a more elegant way of doing this?
         stats = {}
-        event_labels = zip(events, mean_shift.labels_)
-        for event, label in event_labels:
-            # loop accumulate all values for the new clusters
-            if label not in stats:
-                stats[label] = Cluster(int(label))
-            cluster = stats[label]
-            cluster.count += 1
-            cluster.avg_power_active_w += event.power_active_w
-            cluster.avg_power_reactive_var += event.power_reactive_var
-            cluster.avg_power_apparent_va += event.power_apparent_va
-            cluster.avg_line_current_a += event.line_current_a
-            cluster.avg_line_voltage_v += event.line_voltage_v
-
-        for cluster in stats.values():
-            # calculates the mean for each attribute
-            count = float(cluster.count)
-            cluster.avg_power_active_w /= count
-            cluster.avg_power_reactive_var /= count
-            cluster.avg_power_apparent_va /= count
-            cluster.avg_line_current_a /= count
-            cluster.avg_line_voltage_v /= count
-
+        labels = mean_shift.labels_
+        for label in np.unique(labels):
+            cluster_rows = dataset[labels == label]
+            means = cluster_rows[:, :5].mean(axis=0)
+            cluster = Cluster(int(label))
+            cluster.count = len(cluster_rows)
+            cluster.avg_power_active_w = float(means[0])
+            cluster.avg_power_reactive_var = float(means[1])
+            cluster.avg_power_apparent_va = float(means[2])
+            cluster.avg_line_current_a = float(means[3])
+            cluster.avg_line_voltage_v = float(means[4])
+            stats[label] = cluster
         return stats
 
-    def _update_cluster_storage(self, session, events, mean_shift, cluster_stats):
-        """Purges previous cluster information, re-inserting the new values."""
+    def _update_cluster_storage(self, session, event_ids, event_labels, cluster_stats):
+        """
+        Purges previous cluster information, re-inserting the new values.
+        NOTE: events stored on other shards also have rows in `event_cluster`, even though they're
+        not on the main `events` table (SQLite doesn't enforce the foreign key by default).
+        """
         # deletes all previous cluster data
         session.query(Cluster).delete()
         session.query(EventCluster).delete()
         # creates and saves a list of object mappers representing clusters
-        clusters = [EventCluster(int(cid), int(e.id)) for cid, e in zip(mean_shift.labels_, events)]
+        labels = zip(event_labels, event_ids)
+        clusters = [EventCluster(int(cid), int(eid)) for cid, eid in labels]
         session.bulk_save_objects(clusters)
         # stores cluster statistcs
         session.bulk_save_objects(cluster_stats.values())
+        # advances the high-water mark of each shard on the same transaction
+        event_shards = event_ids // SHARD_ID_STRIDE
+        for shard in np.unique(event_shards):
+            shard_max_id = int(event_ids[event_shards == shard].max())
+            set_last_clustered_event_id(session, shard_max_id, int(shard))
         # commits transaction
         session.commit()
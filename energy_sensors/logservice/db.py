@@ -3,7 +3,8 @@
 """Database models and utilities for energy_sensors.logservice functionalities."""
 
 import datetime
-from sqlalchemy import create_engine
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import create_engine, text
 from sqlalchemy.orm import sessionmaker, relationship
 from sqlalchemy import Boolean, Column, Float, ForeignKey, Integer, Text, TIMESTAMP
 from sqlalchemy.ext.declarative import declarative_base
@@ -44,6 +45,9 @@ class EventLog(BASE):
     """
 
     __tablename__ = 'events'
+    # ids are never reused, even if the newest events are deleted, as they're used as high-water
+    # marks for clustering and identify archived events
+    __table_args__ = {'sqlite_autoincrement': True}
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     log_time_utc = Column(TIMESTAMP, nullable=False, default=datetime.datetime.utcnow)
@@ -73,7 +77,8 @@ class EventLog(BASE):
 
             # retrieves device attributes
             device_sec = event_dict['Device']
-            evt.device_id = device_sec['ID']
+            # device ids select the event shard, so they must be integers even if sent as strings
+            evt.device_id = int(device_sec['ID'])
             evt.device_fw = device_sec['Fw']
             evt.device_evt = device_sec['Evt']
 
@@ -214,6 +219,104 @@ class EventCluster(BASE):
     event = relationship(EventLog)
     cluster = relationship(Cluster)
 
+class ClusteringState(BASE):
+    """
+    Stores the clustering progress of each event shard, shared by all logservice processes.
+    Attributes:
+        id                          Primary key, CLUSTERING_STATE_ID plus the shard index.
+        last_clustered_event_id     Id of the newest event of the shard included in the last
+                                    clustering run, used as the high-water mark for triggering the
+                                    next one.
+    """
+
+    __tablename__ = 'clustering_state'
+
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    last_clustered_event_id = Column(Integer, default=0, nullable=False)
+
+CLUSTERING_STATE_ID = 1
+
+def get_last_clustered_event_id(session, shard=0):
+    """
+    Returns the id of the newest event of a shard included in the last clustering run, or the
+    shard's id base if it was never clustered.
+    """
+    state = session.query(ClusteringState).get(CLUSTERING_STATE_ID + shard)
+    return state.last_clustered_event_id if state else shard_id_base(shard)
+
+def set_last_clustered_event_id(session, event_id, shard=0):
+    """Records the id of the newest event of a shard included in a clustering run."""
+    session.merge(ClusteringState(id=CLUSTERING_STATE_ID + shard, last_clustered_event_id=event_id))
+
+# events of each shard get ids starting at shard * SHARD_ID_STRIDE, so ids are globally unique
+SHARD_ID_STRIDE = 2 ** 40
+
+def shard_id_base(shard):
+    """Returns the id right before the first event id of a shard."""
+    return shard * SHARD_ID_STRIDE
+
+def shard_of_event_id(event_id):
+    """Returns the index of the shard storing a given event."""
+    return event_id // SHARD_ID_STRIDE
+
+def shard_db_url(shard):
+    """Returns the database url of a shard. The first shard is the main application database."""
+    if shard == 0:
+        return 'sqlite:///logservice.db'
+    return 'sqlite:///logservice.shard{}.db'.format(shard)
+
+class ShardRouter(object):
+    """
+    Distributes the `events` table across `shard_count` SQLite databases, by device id.
+    This removes the single writer lock bottleneck for ingestion, as events of different shards
+    are stored on separate files. Every other table stays on the main database (the first shard).
+    The shard count can only be increased after initialization, as all reads go through every
+    configured shard.
+    """
+
+    def __init__(self, shard_count=1, debug=False):
+        self.shard_count = shard_count
+        self.engines = [create_engine(shard_db_url(k), echo=debug) for k in range(shard_count)]
+        self.sessionmakers = [sessionmaker(bind=engine) for engine in self.engines]
+
+    def shard_for_device(self, device_id):
+        """Returns the index of the shard responsible for a device."""
+        return device_id % self.shard_count
+
+    def session_for_device(self, device_id):
+        """Returns a new session for the shard responsible for a device."""
+        return self.sessionmakers[self.shard_for_device(device_id)]()
+
+    def scatter(self, query_fn):
+        """
+        Runs query_fn(session) for every shard in parallel, each on its own thread and session.
+        Returns:
+            list of results, ordered by shard index.
+        """
+        def run_on_shard(shard_sessionmaker):
+            session = shard_sessionmaker()
+            try:
+                return query_fn(session)
+            finally:
+                session.close()
+
+        with ThreadPoolExecutor(max_workers=self.shard_count) as executor:
+            return list(executor.map(run_on_shard, self.sessionmakers))
+
+    def create_all(self):
+        """Creates the tables of every shard, if needed."""
+        for shard, engine in enumerate(self.engines):
+            if shard == 0:
+                BASE.metadata.create_all(engine)
+                continue
+            EventLog.__table__.create(engine, checkfirst=True)
+            # seeds the autoincrement sequence, so the shard's ids start at its id base
+            with engine.begin() as conn:
+                conn.execute(text('INSERT INTO sqlite_sequence (name, seq) SELECT :name, :base '
+                                  'WHERE NOT EXISTS '
+                                  '(SELECT 1 FROM sqlite_sequence WHERE name = :name)'),
+                             name=EventLog.__tablename__, base=shard_id_base(shard))
+
 
 def parse_complex_list(string):
     """Returns a list of complex numbers parsed from the format used by the `events` table."""
@@ -231,5 +334,5 @@ def parse_float_list(string):
 
 def get_db_sessionmaker(debug):
     """Returns a SQLAlchemy session for the application's SQLite db."""
-    engine = create_engine('sqlite:///logservice.db', echo=debug)
+    engine = create_engine(shard_db_url(0), echo=debug)
     return sessionmaker(bind=engine)
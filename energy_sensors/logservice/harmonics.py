@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Provides vectorized extraction of clustering features from the FFT harmonics of events."""
+
+import numpy as np
+
+# names of the features that can be extracted from harmonics, see `extract_harmonic_features`
+HARMONIC_FEATURES = ('magnitude', 'thd', 'phase')
+
+def parse_harmonics_matrix(harmonics_strs, width=None):
+    """
+    Returns a 2D complex array with the harmonics of many events, one row per event.
+    harmonics_strs is a sequence of strings in the format of the `fft_harmonics` column. All
+    strings are decoded at once, so there's no Python-level work for each event besides joining
+    them. Rows with less harmonics than the widest row (or `width`, if given) are padded with NaN.
+    Malformed rows are entirely NaN, falling back to decoding each row separately to find them.
+    """
+    harmonics_strs = np.asarray(harmonics_strs, dtype=str)
+    # each harmonic is terminated by a ';', so counting them gives the length of every row
+    counts = np.char.count(harmonics_strs, ';')
+    values = _parse_harmonic_values(''.join(harmonics_strs.tolist()), counts.sum())
+    if values is None or np.any(np.char.count(harmonics_strs, ',') != counts):
+        row_values = [_parse_harmonic_values(s, c) if s.count(',') == c else None
+                      for s, c in zip(harmonics_strs.tolist(), counts.tolist())]
+        # malformed rows are left with no harmonics, so they're filled with NaN
+        counts = np.array([0 if v is None else len(v) // 2 for v in row_values], dtype=int)
+        values = np.concatenate([np.empty(0)] + [v for v in row_values if v is not None])
+    complex_values = values[0::2] + 1j * values[1::2]
+
+    if width is None:
+        width = int(counts.max()) if len(counts) else 0
+    # scatters the flat list of harmonics to their (row, column) position on the matrix
+    rows = np.repeat(np.arange(len(counts)), counts)
+    cols = np.arange(len(complex_values)) - np.repeat(np.cumsum(counts) - counts, counts)
+    in_width = cols < width
+    matrix = np.full((len(counts), width), np.nan, dtype=np.complex128)
+    matrix[rows[in_width], cols[in_width]] = complex_values[in_width]
+    return matrix
+
+def _parse_harmonic_values(harmonics_str, count):
+    """
+    Returns the real and imaginary parts of `count` harmonics as a flat float array, or None if
+    harmonics_str doesn't contain exactly that many (real,imaginary) pairs.
+    """
+    try:
+        # newer numpy versions raise on malformed data, older ones stop parsing (with a warning)
+        values = np.fromstring(harmonics_str.replace(',', ';'), dtype=np.float64, sep=';')
+    except ValueError:
+        return None
+    return values if len(values) == 2 * count else None
+
+def magnitude_spectrum(harmonics):
+    """Returns the magnitude of each harmonic."""
+    return np.abs(harmonics)
+
+def total_harmonic_distortion(harmonics):
+    """
+    Returns the total harmonic distortion of each row, assuming the first column is the
+    fundamental frequency. Missing harmonics are ignored, rows with no fundamental result in 0.
+    """
+    magnitudes = np.nan_to_num(np.abs(harmonics))
+    fundamental = magnitudes[:, 0] if harmonics.shape[1] else np.zeros(len(harmonics))
+    distortion = np.sqrt(np.sum(magnitudes[:, 1:] ** 2, axis=1))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        thd = distortion / fundamental
+    thd[fundamental == 0] = 0.0
+    return thd
+
+def harmonic_phases(harmonics):
+    """Returns the phase, in radians, of each harmonic."""
+    return np.angle(harmonics)
+
+def harmonic_feature_count(names, count):
+    """Returns the number of columns `extract_harmonic_features` results in."""
+    return sum(1 if name == 'thd' else count for name in names)
+
+def extract_harmonic_features(harmonics, names, count):
+    """
+    Returns a 2D array with the selected features for each row of a harmonics matrix.
+    The first `count` harmonics are used, missing ones being treated as zero. Features are
+    concatenated in the order given by names, 'magnitude' and 'phase' contributing `count`
+    columns each, and 'thd' a single column.
+    """
+    fitted = np.zeros((len(harmonics), count), dtype=np.complex128)
+    width = min(count, harmonics.shape[1])
+    fitted[:, :width] = np.nan_to_num(harmonics[:, :width])
+    extractors = {'magnitude': magnitude_spectrum,
+                  'thd': lambda h: total_harmonic_distortion(h)[:, np.newaxis],
+                  'phase': harmonic_phases}
+    return np.hstack([np.empty((len(harmonics), 0))] + [extractors[n](fitted) for n in names])
@@ -4,13 +4,38 @@
 
 from flask import Flask, request, json
 import energy_sensors.lib.eventparser as eventparser
-from energy_sensors.logservice.db import Cluster, EventLog, get_db_sessionmaker
-from energy_sensors.logservice.clustering import ClusteringBatchWorker
+from energy_sensors.logservice.db import Cluster, EventLog, ShardRouter, get_db_sessionmaker
 from energy_sensors.lib.responseutils import json_error_response, json_response
 
 app = Flask(__name__)
-# this should really be a separate process for the optimal performance
-clustering_worker = ClusteringBatchWorker(1000)
+# archival of old events is disabled unless ARCHIVE_PATH is set on the settings file
+app.config.update(INGEST_ONLY=False, SHARD_COUNT=1, ARCHIVE_PATH=None, RETENTION_DAYS=30,
+                  COMPACTION_INTERVAL_S=3600, CLUSTERING_HARMONIC_FEATURES=(),
+                  CLUSTERING_LOCK_PATH='logservice.clustering.lock', CLUSTERING_HISTORY_DAYS=0)
+app.config.from_envvar('LOGSERVICE_SETTINGS', silent=True)
+
+# routes stored events to their device's shard
+router = ShardRouter(app.config['SHARD_COUNT'], debug=True)
+# consecutive events repeat most sections, which are parsed only once
+parse_cache = eventparser.ParseCache()
+
+clustering_worker = None
+if not app.config['INGEST_ONLY']:
+    # background jobs depend on numeric libraries, which ingest-only workers never import
+    from energy_sensors.logservice.clustering import ClusteringBatchWorker
+    from energy_sensors.logservice.retention import CompactionWorker, EventArchive
+
+    archive = EventArchive(app.config['ARCHIVE_PATH']) if app.config['ARCHIVE_PATH'] else None
+    # this should really be a separate process for the optimal performance
+    clustering_worker = ClusteringBatchWorker(1000, archive,
+                                              app.config['CLUSTERING_HARMONIC_FEATURES'],
+                                              lock_path=app.config['CLUSTERING_LOCK_PATH'],
+                                              router=router,
+                                              history_days=app.config['CLUSTERING_HISTORY_DAYS'])
+    if archive:
+        compaction_worker = CompactionWorker(archive, app.config['RETENTION_DAYS'],
+                                             app.config['COMPACTION_INTERVAL_S'], router)
+        compaction_worker.start()
 
 @app.route('/log/store', methods=['POST'])
 def log_store():
@@ -24,7 +49,7 @@ def log_store():
     if content_type == text_mime:
         # parse data before attempting to store
         data_str = request.data.decode('utf-8')
-        event_dict = eventparser.parse_event_to_dict(data_str)
+        event_dict = eventparser.parse_event_to_dict(data_str, parse_cache)
         if not event_dict:
             return json_error_response('Failed to parse event text.')
 
@@ -43,11 +68,14 @@ def log_store():
     if not log_entry:
         return json_error_response('Unabled to extract all fields from the given data.')
 
-    session = get_db_sessionmaker(debug=True)()
+    session = router.session_for_device(log_entry.device_id)
     session.add(log_entry)
+    session.flush() # assigns the event id, without reloading the entry after commiting
+    event_id = log_entry.id
     session.commit()
 
-    clustering_worker.report_event_received()
+    if clustering_worker:
+        clustering_worker.report_event_received(event_id)
 
     # returns an empty json, also indicading success via http status code
     return json_response({})
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Provides time-partitioned archival of old events, keeping the hot database small."""
+
+import datetime
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import numpy as np
+from energy_sensors.lib.arrayutils import ids_in
+from energy_sensors.lib.filelock import try_lock
+from energy_sensors.logservice.db import EventLog, ShardRouter, parse_float_list
+from energy_sensors.logservice.harmonics import parse_harmonics_matrix
+
+# columns stored (losslessly) in the compressed archive of each segment
+ARCHIVED_COLUMNS = ['id', 'log_time_utc', 'device_id', 'device_fw', 'device_evt',
+                    'reported_time_utc', 'coil_reversed', 'power_active_w', 'power_reactive_var',
+                    'power_apparent_va', 'line_current_a', 'line_voltage_v', 'line_phase_rad',
+                    'line_frequency', 'current_peaks_list', 'fft_harmonics', 'wifi_strength_dbm',
+                    'dummy_data']
+
+# numeric columns also stored uncompressed, so they can be memory-mapped when loading history
+MAPPED_COLUMNS = ['id', 'power_active_w', 'power_reactive_var', 'power_apparent_va',
+                  'line_current_a', 'line_voltage_v', 'current_peaks', 'harmonics']
+
+_MANIFEST_NAME = 'manifest.json'
+_COMPRESSED_NAME = 'events.npz'
+_LOCK_NAME = 'compaction.lock'
+
+class EventArchive(object):
+    """
+    Stores events that left the hot window as daily segments on the filesystem.
+    Each segment is a directory named after the UTC day its events were logged on, containing a
+    compressed `events.npz` file with every column of the `events` table and one uncompressed
+    `.npy` file for each column in MAPPED_COLUMNS. Compressed members can't be memory-mapped, so
+    the uncompressed copies are what the clustering loader reads when a run needs history.
+    Variable-length peaks and harmonics are stored in the `current_peaks` and `harmonics`
+    matrices, padded with NaN.
+
+    A small `manifest.json` file lists all segments with their row count and id range, and is
+    always replaced atomically after a segment is written.
+
+    Segments are read, merged and replaced by `write_segment`, so writers on different processes
+    must hold the lock file at `lock_path` (as CompactionWorker does).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock_path = os.path.join(path, _LOCK_NAME)
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+
+    def segments(self):
+        """Returns the list of manifest entries, ordered by day."""
+        manifest_path = os.path.join(self.path, _MANIFEST_NAME)
+        if not os.path.exists(manifest_path):
+            return []
+        with open(manifest_path) as manifest_file:
+            return json.load(manifest_file)['segments']
+
+    def write_segment(self, day, events):
+        """
+        Archives a list of events logged on the given day, merging them with the existing segment.
+        Events that were already archived (same id) are skipped, so interrupted compactions can be
+        safely retried.
+        """
+        columns = _events_to_columns(events)
+        with self._lock:
+            segment_dir = self._segment_dir(day)
+            if os.path.exists(segment_dir):
+                columns = _merge_columns(self.load_segment(day), columns)
+            self._replace_segment(day, columns)
+            self._update_manifest(day, columns)
+        return len(columns['id'])
+
+    def load_segment(self, day, mmap=False):
+        """
+        Returns a dictionary with all archived columns for a given day.
+        If mmap is set, only MAPPED_COLUMNS are returned, as read-only memory-mapped arrays.
+        """
+        segment_dir = self._segment_dir(day)
+        if mmap:
+            return {c: np.load(os.path.join(segment_dir, c + '.npy'), mmap_mode='r')
+                    for c in MAPPED_COLUMNS}
+        with np.load(os.path.join(segment_dir, _COMPRESSED_NAME)) as npz:
+            return {c: npz[c] for c in ARCHIVED_COLUMNS}
+
+    def load_mapped_segments(self, max_segments=None):
+        """
+        Returns a list with the memory-mapped columns of archived segments.
+        If max_segments is given, only the most recent ones are returned.
+        """
+        segments = self.segments()
+        if max_segments is not None:
+            segments = segments[-max_segments:] if max_segments > 0 else []
+        return [self.load_segment(s['day'], mmap=True) for s in segments]
+
+    def _segment_dir(self, day):
+        # days are either datetime.date objects or their ISO representation, used by the manifest
+        return os.path.join(self.path, str(day))
+
+    def _replace_segment(self, day, columns):
+        """Writes a segment to a temporary directory, swapping it with the previous version."""
+        segment_dir = self._segment_dir(day)
+        # temporary directories are unique, so leftovers of interrupted writes are never reused
+        tmp_dir = tempfile.mkdtemp(prefix=str(day) + '.', suffix='.tmp', dir=self.path)
+        old_dir = tmp_dir + '.old'
+        np.savez_compressed(os.path.join(tmp_dir, _COMPRESSED_NAME),
+                            **{c: columns[c] for c in ARCHIVED_COLUMNS})
+        for column in MAPPED_COLUMNS:
+            np.save(os.path.join(tmp_dir, column + '.npy'), columns[column])
+        if os.path.exists(segment_dir):
+            os.rename(segment_dir, old_dir)
+        os.rename(tmp_dir, segment_dir)
+        shutil.rmtree(old_dir, ignore_errors=True)
+
+    def _update_manifest(self, day, columns):
+        """Registers a segment on the manifest, replacing any previous entry for the same day."""
+        segments = [s for s in self.segments() if s['day'] != str(day)]
+        segments.append({'day': str(day),
+                         'count': int(len(columns['id'])),
+                         'min_id': int(columns['id'].min()),
+                         'max_id': int(columns['id'].max())})
+        segments.sort(key=lambda s: s['day'])
+        manifest_path = os.path.join(self.path, _MANIFEST_NAME)
+        tmp_path = '{}.{}.tmp'.format(manifest_path, os.getpid())
+        with open(tmp_path, 'w') as manifest_file:
+            json.dump({'segments': segments}, manifest_file, indent=2)
+        os.replace(tmp_path, manifest_path)
+
+class CompactionWorker(object):
+    """
+    Periodically moves events older than the hot window from the database to an EventArchive.
+    The hot window is always aligned to UTC midnight, so only whole days are archived. Compaction
+    runs on a daemon thread, once when started and then every `interval_s` seconds. Events are
+    read through `router`, and if they're sharded, all shards are compacted in parallel.
+
+    Every logservice process may run a CompactionWorker, but runs are guarded by the archive lock
+    file: a run is skipped while another process (or thread) holds it.
+    """
+
+    def __init__(self, archive, retention_days=30, interval_s=3600, router=None):
+        self.archive = archive
+        self.router = router or ShardRouter()
+        self.retention_days = retention_days
+        self.interval_s = interval_s
+        self.worker_thread = None
+        self._stop_event = threading.Event()
+
+    def start(self):
+        """Spawns the compaction thread."""
+        self._stop_event.clear()
+        self.worker_thread = threading.Thread(target=self._run, daemon=True)
+        self.worker_thread.start()
+
+    def stop(self):
+        """Signals the compaction thread to finish, waiting for the current run."""
+        self._stop_event.set()
+        if self.worker_thread:
+            self.worker_thread.join()
+
+    def compact(self, now=None):
+        """Archives all events before the hot window. Returns the number of archived events."""
+        now = now or datetime.datetime.utcnow()
+        today = datetime.datetime(now.year, now.month, now.day)
+        cutoff = today - datetime.timedelta(days=self.retention_days)
+        lock_file = try_lock(self.archive.lock_path)
+        if lock_file is None:
+            logging.info('Compaction is already running elsewhere, skipping.')
+            return 0
+        try:
+            return sum(self.router.scatter(lambda s: compact_events(s, self.archive, cutoff)))
+        finally:
+            lock_file.close()
+
+    def _run(self):
+        while True:
+            try:
+                archived = self.compact()
+                if archived:
+                    logging.info('Archived %d events older than the hot window.', archived)
+            except Exception: # pylint: disable=broad-except
+                logging.exception('Event compaction failed!')
+            if self._stop_event.wait(self.interval_s):
+                break
+
+def compact_events(session, archive, cutoff):
+    """
+    Moves all events logged before cutoff from the database to the archive, one day at a time.
+    Each day is written to the archive before being deleted from the database, so no data is lost
+    if the process is interrupted in between.
+    """
+    archived = 0
+    while True:
+        oldest = session.query(EventLog.log_time_utc) \
+                        .filter(EventLog.log_time_utc < cutoff) \
+                        .order_by(EventLog.log_time_utc).first()
+        if oldest is None:
+            return archived
+        day = oldest.log_time_utc.date()
+        day_start = datetime.datetime(day.year, day.month, day.day)
+        day_end = min(day_start + datetime.timedelta(days=1), cutoff)
+        in_day = (EventLog.log_time_utc >= day_start) & (EventLog.log_time_utc < day_end)
+        events = session.query(EventLog).filter(in_day).order_by(EventLog.id).all()
+        archive.write_segment(day, events)
+        session.query(EventLog).filter(in_day).delete(synchronize_session=False)
+        session.commit()
+        session.expunge_all()
+        archived += len(events)
+
+def _events_to_columns(events):
+    """Returns a dictionary of numpy arrays with the column values of a list of events."""
+    columns = {c: np.array([getattr(e, c) for e in events]) for c in ARCHIVED_COLUMNS}
+    # datetimes and strings are converted to native dtypes, avoiding pickled object arrays
+    for column in ['log_time_utc', 'reported_time_utc']:
+        columns[column] = columns[column].astype('datetime64[us]')
+    for column in ['current_peaks_list', 'fft_harmonics']:
+        columns[column] = columns[column].astype(str)
+    columns['current_peaks'] = _pad_rows([e.get_peaks() for e in events])
+    columns['harmonics'] = parse_harmonics_matrix(columns['fft_harmonics'])
+    return columns
+
+def _merge_columns(previous, columns):
+    """Appends rows from columns to previous, skipping ids that were already archived."""
+    new_rows = ~ids_in(columns['id'], previous['id'])
+    merged = {c: np.concatenate([previous[c], columns[c][new_rows]]) for c in ARCHIVED_COLUMNS}
+    merged['current_peaks'] = _pad_rows([parse_float_list(p) for p in merged['current_peaks_list']])
+    merged['harmonics'] = parse_harmonics_matrix(merged['fft_harmonics'])
+    return merged
+
+def _pad_rows(rows):
+    """Returns a 2D float array built from rows of varying length, padded with NaN."""
+    width = max((len(r) for r in rows), default=0)
+    matrix = np.full((len(rows), width), np.nan)
+    for idx, row in enumerate(rows):
+        matrix[idx, :len(row)] = row
+    return matrix
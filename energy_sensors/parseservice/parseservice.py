@@ -14,6 +14,8 @@ class MiniJSONEncoder(JSONEncoder):
 app = Flask(__name__)
 app.json_decoder = MiniJSONEncoder
 app.config['JSONIFY_PRETTYPRINT_REGULAR'] = False
+# consecutive events repeat most sections, which are parsed only once
+parse_cache = eventparser.ParseCache()
 
 @app.route('/log/parse', methods=['POST'])
 def log_parse():
@@ -26,7 +28,7 @@ def log_parse():
 
     # decode post data and parse
     data_str = request.data.decode('utf-8')
-    event_dict = eventparser.parse_event_to_dict(data_str)
+    event_dict = eventparser.parse_event_to_dict(data_str, parse_cache)
     if not event_dict:
         return json_error_response('Failed to parse event text.')
 
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Measures the import time and peak RSS of logservice, in both default and ingest-only modes.
+Usage: bench_logservice_startup.py [max ingest-only seconds] [max ingest-only RSS in MB]
+Exits with a non-zero status if the ingest-only median exceeds any of the given limits.
+"""
+
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+RUNS = 5
+
+# ran on a fresh interpreter, printing the import time in seconds and the peak RSS in KB (linux)
+CHILD_CODE = '''
+import resource, time
+start = time.perf_counter()
+import energy_sensors.logservice.logservice
+elapsed = time.perf_counter() - start
+print(elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+'''
+
+def measure(ingest_only):
+    """Returns the median import time and peak RSS (in MB) of logservice."""
+    with tempfile.NamedTemporaryFile('w', suffix='.py') as settings_file:
+        settings_file.write('INGEST_ONLY = {}\n'.format(ingest_only))
+        settings_file.flush()
+        env = dict(os.environ, LOGSERVICE_SETTINGS=settings_file.name)
+        times, rss = [], []
+        for _ in range(RUNS):
+            output = subprocess.check_output([sys.executable, '-c', CHILD_CODE], env=env)
+            elapsed, maxrss_kb = output.split()
+            times.append(float(elapsed))
+            rss.append(int(maxrss_kb) / 1024.0)
+    return statistics.median(times), statistics.median(rss)
+
+default_time, default_rss = measure(ingest_only=False)
+ingest_time, ingest_rss = measure(ingest_only=True)
+print('default:     {:.3f}s {:.1f}MB'.format(default_time, default_rss))
+print('ingest-only: {:.3f}s {:.1f}MB'.format(ingest_time, ingest_rss))
+
+max_time = float(sys.argv[1]) if len(sys.argv) > 1 else None
+max_rss = float(sys.argv[2]) if len(sys.argv) > 2 else None
+if (max_time and ingest_time > max_time) or (max_rss and ingest_rss > max_rss):
+    print('Ingest-only startup exceeded the given limits!')
+    sys.exit(1)
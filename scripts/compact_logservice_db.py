@@ -0,0 +1,18 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Moves events older than the hot window from the logservice database to the archive.
+Usage: compact_logservice_db.py <archive path> [retention days] [shard count]
+"""
+
+import sys
+from energy_sensors.logservice.db import ShardRouter
+from energy_sensors.logservice.retention import CompactionWorker, EventArchive
+
+archive_path = sys.argv[1]
+retention_days = int(sys.argv[2]) if len(sys.argv) > 2 else 30
+shard_count = int(sys.argv[3]) if len(sys.argv) > 3 else 1
+compaction_worker = CompactionWorker(EventArchive(archive_path), retention_days,
+                                     router=ShardRouter(shard_count))
+archived = compaction_worker.compact()
+print('Archived {} events.'.format(archived))
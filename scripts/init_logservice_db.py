@@ -1,11 +1,12 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 """
-Initializes an SQLite database for the logservice.
+Initializes the SQLite databases for the logservice.
+Usage: init_logservice_db.py [shard count]
 """
 
-import energy_sensors.logservice.db
-from sqlalchemy import create_engine
+import sys
+from energy_sensors.logservice.db import ShardRouter
 
-ENGINE = create_engine('sqlite:///logservice.db', echo=True)
-energy_sensors.logservice.db.BASE.metadata.create_all(ENGINE)
+shard_count = int(sys.argv[1]) if len(sys.argv) > 1 else 1
+ShardRouter(shard_count, debug=True).create_all()
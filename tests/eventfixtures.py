@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Sample events and temporary databases shared by the logservice tests."""
+
+import contextlib
+import datetime
+import os
+import tempfile
+import energy_sensors.lib.eventparser as eventparser
+from energy_sensors.logservice.db import EventLog, ShardRouter
+
+EVENT_STR = ('Device: ID=1; Fw=16071801; Evt=2; Alarms: CoilRevesed=OFF; Power: Active=1753W; '
+             'Reactive=279var; Appearent=403VA; Line: Current=7.35900021; Voltage=230.08V; '
+             'Phase=-43,841rad; Peaks: 7.33199978;7.3119997;7.53000021; FFT Re: 9748;46;303; '
+             'FFT Img: 2712;6;-792; UTC Time: 2016-10-4 16:47:50; hz: 49.87; WiFi Strength: -62; '
+             'Dummy: 20')
+
+DAY = datetime.date(2016, 10, 4)
+
+def make_events(ids, log_time_utc=datetime.datetime(2016, 10, 4, 17, 0, 0)):
+    """Returns events with the given ids, split in two groups of very different active power."""
+    events = []
+    for event_id in ids:
+        event = EventLog.from_event_dict(eventparser.parse_event_to_dict(EVENT_STR))
+        event.id = event_id
+        event.log_time_utc = log_time_utc
+        event.power_active_w = (100.0 if event_id % 2 else 2000.0) + event_id
+        events.append(event)
+    return events
+
+@contextlib.contextmanager
+def temp_database(shard_count=1):
+    """
+    Creates the logservice databases on a temporary working directory, which is deleted on exit.
+    Yields the router of the created shards and the path of the directory.
+    """
+    previous_cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as temp_dir:
+        os.chdir(temp_dir)
+        router = ShardRouter(shard_count)
+        try:
+            router.create_all()
+            yield router, temp_dir
+        finally:
+            for engine in router.engines:
+                engine.dispose()
+            os.chdir(previous_cwd)
+
+def store_events(router, events):
+    """Stores events on the first shard."""
+    session = router.sessionmakers[0]()
+    session.add_all(events)
+    session.commit()
+    session.close()
@@ -0,0 +1,15 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Tests for the numpy helpers."""
+
+import numpy as np
+from energy_sensors.lib.arrayutils import ids_in
+
+def test_ids_in():
+    """Checks membership of ids, including ids past both ends of the reference."""
+    mask = ids_in(np.array([0, 1, 3, 4, 9]), np.array([4, 1, 3]))
+    assert list(mask) == [False, True, True, True, False]
+
+def test_ids_in_empty_reference():
+    """Checks that no id is found in an empty reference."""
+    assert list(ids_in(np.array([1, 2]), np.array([], dtype=np.int64))) == [False, False]
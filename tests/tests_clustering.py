@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Tests for the logservice clustering worker."""
+
+import os
+from nose.tools import raises
+from energy_sensors.lib.filelock import try_lock
+from energy_sensors.logservice.clustering import ClusteringBatchWorker
+from energy_sensors.logservice.db import Cluster, EventCluster, get_last_clustered_event_id
+from energy_sensors.logservice.retention import EventArchive
+from eventfixtures import DAY, make_events, store_events, temp_database
+
+def _make_archive(path, ids):
+    archive = EventArchive(path)
+    archive.write_segment(DAY, make_events(ids))
+    return archive
+
+def _clustering_results(router):
+    session = router.sessionmakers[0]()
+    clustered_ids = sorted(e for e, in session.query(EventCluster.event_id))
+    clustered_count = sum(c.count for c in session.query(Cluster))
+    last_clustered_id = get_last_clustered_event_id(session)
+    session.close()
+    return clustered_ids, clustered_count, last_clustered_id
+
+def _run_clustering(router, worker):
+    session = router.sessionmakers[0]()
+    worker._compute_clusters(session) # pylint: disable=protected-access
+    session.close()
+    return _clustering_results(router)
+
+def _report_events(worker, ids):
+    for event_id in ids:
+        worker.report_event_received(event_id)
+    if worker.worker_thread:
+        worker.worker_thread.join()
+
+def test_archived_history_included():
+    """Checks that recent archived events are clustered, without getting event_cluster rows."""
+    with temp_database() as (router, temp_dir):
+        # event 11 was compacted after being read from the database, so it's found on both
+        store_events(router, make_events(range(11, 21)))
+        archive = _make_archive(os.path.join(temp_dir, 'archive'), range(1, 12))
+        worker = ClusteringBatchWorker(1, archive, history_days=1,
+                                       lock_path=os.path.join(temp_dir, 'clustering.lock'),
+                                       router=router)
+        clustered_ids, clustered_count, last_clustered_id = _run_clustering(router, worker)
+        assert clustered_ids == list(range(11, 21))
+        assert clustered_count == 20
+        assert last_clustered_id == 20
+
+def test_archived_history_disabled_by_default():
+    """Checks that archived events are ignored unless history_days is set."""
+    with temp_database() as (router, temp_dir):
+        store_events(router, make_events(range(11, 21)))
+        archive = _make_archive(os.path.join(temp_dir, 'archive'), range(1, 11))
+        worker = ClusteringBatchWorker(1, archive,
+                                       lock_path=os.path.join(temp_dir, 'clustering.lock'),
+                                       router=router)
+        clustered_ids, clustered_count, _ = _run_clustering(router, worker)
+        assert clustered_ids == list(range(11, 21))
+        assert clustered_count == 10
+
+def test_no_run_below_batch_size():
+    """Checks that no computation is triggered before a batch is complete."""
+    with temp_database() as (router, temp_dir):
+        store_events(router, make_events(range(1, 10)))
+        worker = ClusteringBatchWorker(10, lock_path=os.path.join(temp_dir, 'clustering.lock'),
+                                       router=router)
+        _report_events(worker, range(1, 10))
+        assert worker.worker_thread is None
+        assert _clustering_results(router) == ([], 0, 0)
+
+def test_run_at_batch_size():
+    """Checks that a computation runs once batch_size events are past the high-water mark."""
+    with temp_database() as (router, temp_dir):
+        store_events(router, make_events(range(1, 11)))
+        worker = ClusteringBatchWorker(10, lock_path=os.path.join(temp_dir, 'clustering.lock'),
+                                       router=router)
+        _report_events(worker, range(1, 11))
+        assert worker.worker_thread is not None
+        assert _clustering_results(router) == (list(range(1, 11)), 10, 10)
+
+@raises(IOError)
+def test_mark_committed_with_clusters():
+    """Checks that the high-water mark only advances on the same commit as the clusters."""
+    def failing_commit():
+        raise IOError('Simulated failure.')
+
+    with temp_database() as (router, temp_dir):
+        store_events(router, make_events(range(1, 11)))
+        worker = ClusteringBatchWorker(10, lock_path=os.path.join(temp_dir, 'clustering.lock'),
+                                       router=router)
+        session = router.sessionmakers[0]()
+        session.commit = failing_commit
+        try:
+            worker._compute_clusters(session) # pylint: disable=protected-access
+        finally:
+            session.close()
+            assert _clustering_results(router) == ([], 0, 0)
+
+def test_held_lock_skips_run():
+    """Checks that a batch is skipped while another process holds the clustering lock."""
+    with temp_database() as (router, temp_dir):
+        store_events(router, make_events(range(1, 11)))
+        worker = ClusteringBatchWorker(10, lock_path=os.path.join(temp_dir, 'clustering.lock'),
+                                       router=router)
+        lock_file = try_lock(worker.lock_path)
+        try:
+            _report_events(worker, range(1, 11))
+        finally:
+            lock_file.close()
+        assert worker.worker_thread is None
+        assert _clustering_results(router) == ([], 0, 0)
+
+def test_batch_formed_while_locked():
+    """Checks that a batch reported while the lock was held is clustered by the next event."""
+    with temp_database() as (router, temp_dir):
+        store_events(router, make_events(range(1, 16)))
+        worker = ClusteringBatchWorker(10, lock_path=os.path.join(temp_dir, 'clustering.lock'),
+                                       router=router)
+        lock_file = try_lock(worker.lock_path)
+        try:
+            _report_events(worker, range(1, 11))
+        finally:
+            lock_file.close()
+        _report_events(worker, [11])
+        assert _clustering_results(router) == (list(range(1, 16)), 15, 15)
+
+def test_batch_formed_during_run():
+    """Checks that events stored while a computation runs are clustered before it finishes."""
+    class _IngestingWorker(ClusteringBatchWorker):
+        """Worker storing another batch of events while its first computation runs."""
+        ingested = False
+
+        def _compute_clusters(self, session):
+            successful = super()._compute_clusters(session)
+            if not self.ingested:
+                self.ingested = True
+                store_events(router, make_events(range(11, 21)))
+            return successful
+
+    with temp_database() as (router, temp_dir):
+        store_events(router, make_events(range(1, 11)))
+        worker = _IngestingWorker(10, lock_path=os.path.join(temp_dir, 'clustering.lock'),
+                                  router=router)
+        _report_events(worker, range(1, 11))
+        assert _clustering_results(router) == (list(range(1, 21)), 20, 20)
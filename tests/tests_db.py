@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Tests for the logservice database models and utilities."""
+
+import energy_sensors.lib.eventparser as eventparser
+from energy_sensors.logservice.db import EventLog, SHARD_ID_STRIDE, get_last_clustered_event_id, \
+                                        set_last_clustered_event_id, shard_of_event_id
+from eventfixtures import EVENT_STR, temp_database
+
+def _event_dict(device_id):
+    event_dict = eventparser.parse_event_to_dict(EVENT_STR)
+    event_dict['Device']['ID'] = device_id
+    return event_dict
+
+def _store_event(router, device_id):
+    """Stores an event through the router, returning its id."""
+    session = router.session_for_device(device_id)
+    event = EventLog.from_event_dict(_event_dict(device_id))
+    session.add(event)
+    session.commit()
+    event_id = event.id
+    session.close()
+    return event_id
+
+def test_device_id_string_converted():
+    """Checks that device ids sent as strings (e.g. in json payloads) are stored as integers."""
+    assert EventLog.from_event_dict(_event_dict('7')).device_id == 7
+
+def test_device_id_invalid():
+    """Checks that events with a non-integer device id are rejected."""
+    assert EventLog.from_event_dict(_event_dict('abc')) is None
+    assert EventLog.from_event_dict(_event_dict(None)) is None
+
+def test_shard_ids_seeded():
+    """Checks that each shard assigns ids starting at its own id base."""
+    with temp_database(3) as (router, _):
+        event_ids = [_store_event(router, device_id) for device_id in range(6)]
+        assert event_ids == [1, SHARD_ID_STRIDE + 1, 2 * SHARD_ID_STRIDE + 1,
+                             2, SHARD_ID_STRIDE + 2, 2 * SHARD_ID_STRIDE + 2]
+        assert [shard_of_event_id(e) for e in event_ids] == [0, 1, 2, 0, 1, 2]
+        assert [router.shard_for_device(d) for d in range(6)] == [0, 1, 2, 0, 1, 2]
+
+def test_create_all_keeps_sequences():
+    """Checks that initializing existing shards again doesn't reset their ids."""
+    with temp_database(2) as (router, _):
+        _store_event(router, 1)
+        router.create_all()
+        assert _store_event(router, 1) == SHARD_ID_STRIDE + 2
+
+def test_scatter_ordered_by_shard():
+    """Checks that scatter runs on every shard, returning results in shard order."""
+    with temp_database(3) as (router, _):
+        for device_id in [2, 2, 0, 1, 2]:
+            _store_event(router, device_id)
+        shard_ids = router.scatter(lambda s: [e for e, in s.query(EventLog.id)
+                                                                .order_by(EventLog.id)])
+        assert shard_ids == [[1], [SHARD_ID_STRIDE + 1],
+                             [2 * SHARD_ID_STRIDE + 1, 2 * SHARD_ID_STRIDE + 2,
+                              2 * SHARD_ID_STRIDE + 3]]
+        merged_ids = [e for ids in shard_ids for e in ids]
+        assert merged_ids == sorted(merged_ids)
+
+def test_clustering_marks_per_shard():
+    """Checks that each shard keeps its own clustering high-water mark on the main database."""
+    with temp_database(3) as (router, _):
+        session = router.sessionmakers[0]()
+        set_last_clustered_event_id(session, SHARD_ID_STRIDE + 10, 1)
+        session.commit()
+        assert get_last_clustered_event_id(session, 0) == 0
+        assert get_last_clustered_event_id(session, 1) == SHARD_ID_STRIDE + 10
+        assert get_last_clustered_event_id(session, 2) == 2 * SHARD_ID_STRIDE
+        session.close()
@@ -66,3 +66,35 @@ def test_key_value_end_no_semicolon():
 def test_semicolon_in_value():
     """Tests if key-value pairs containing semicolons cause a parse error."""
     eventparser.parse_event_to_dict('Foo: Bar=:')
+
+def test_cached_sections():
+    """Checks if repeated sections are served from the cache, with the same results."""
+    cache = eventparser.ParseCache()
+    event_str = 'Foo: A=0; B=1; Bar: X; Y; Time: 2016-10-4 16:47:50; Baz: 1'
+    expected = eventparser.parse_event_to_dict(event_str)
+    assert eventparser.parse_event_to_dict(event_str, cache) == expected
+    assert cache.section_info().misses == 4
+    assert eventparser.parse_event_to_dict(event_str, cache) == expected
+    assert cache.section_info().hits == 4
+
+def test_cached_results_not_shared():
+    """Checks if changing a parsed event doesn't affect later cached results."""
+    cache = eventparser.ParseCache()
+    event_dict = eventparser.parse_event_to_dict('Foo: A=0; Bar: X; Y;', cache)
+    event_dict['Foo']['A'] = 1
+    event_dict['Bar'].append('Z')
+    assert eventparser.parse_event_to_dict('Foo: A=0; Bar: X; Y;', cache) == \
+        {'Foo': {'A': 0}, 'Bar': ['X', 'Y']}
+
+def test_cache_size_limit():
+    """Checks if the cache doesn't grow over its maximum size."""
+    cache = eventparser.ParseCache(max_sections=2, max_values=2)
+    events = ['Foo: A={};'.format(i) for i in range(10)]
+    assert list(eventparser.parse_events(events, cache)) == [{'Foo': {'A': i}} for i in range(10)]
+    assert cache.section_info().currsize == 2
+    assert cache.value_info().currsize == 2
+
+@raises(eventparser.EventParseError)
+def test_cached_semicolon_in_value():
+    """Checks if parse errors are still raised when using a cache."""
+    eventparser.parse_event_to_dict('Foo: Bar=:', eventparser.ParseCache())
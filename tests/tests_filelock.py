@@ -0,0 +1,19 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Tests for the file lock utilities."""
+
+import os
+import tempfile
+from energy_sensors.lib.filelock import try_lock
+
+def test_lock_is_exclusive():
+    """Checks that a held lock can't be acquired again until released."""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, 'test.lock')
+        lock_file = try_lock(path)
+        assert lock_file is not None
+        assert try_lock(path) is None
+        lock_file.close()
+        second_lock_file = try_lock(path)
+        assert second_lock_file is not None
+        second_lock_file.close()
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Tests for the vectorized harmonics feature extraction."""
+
+import numpy as np
+import energy_sensors.logservice.harmonics as harmonics
+from energy_sensors.logservice.db import parse_complex_list
+
+def test_parse_matches_complex_list():
+    """Checks if the matrix has the same values as parsing each row separately."""
+    rows = ['9748,2712;46,6;303,-792;', '10421.5,1696;26,-6;264,-871;']
+    matrix = harmonics.parse_harmonics_matrix(rows)
+    assert matrix.shape == (2, 3)
+    for row, row_str in zip(matrix, rows):
+        assert list(row) == parse_complex_list(row_str)
+
+def test_parse_pads_short_rows():
+    """Checks if rows with less harmonics are padded with NaN."""
+    matrix = harmonics.parse_harmonics_matrix(['1,2;3,4;', '', '5,6;'])
+    assert matrix.shape == (3, 2)
+    assert matrix[2, 0] == 5 + 6j
+    assert np.isnan(matrix[1]).all() and np.isnan(matrix[2, 1])
+
+def test_parse_width():
+    """Checks if extra harmonics are dropped when a width is given."""
+    matrix = harmonics.parse_harmonics_matrix(['1,2;3,4;', '5,6;'], width=1)
+    assert list(matrix[:, 0]) == [1 + 2j, 5 + 6j]
+
+def test_parse_malformed_rows():
+    """Checks if only malformed rows are filled with NaN."""
+    rows = ['1,2;3,4;', '5,x;', '7,8;', '9;10;', '11,12;13,']
+    matrix = harmonics.parse_harmonics_matrix(rows)
+    assert matrix.shape == (5, 2)
+    assert list(matrix[0]) == [1 + 2j, 3 + 4j]
+    assert matrix[2, 0] == 7 + 8j and np.isnan(matrix[2, 1])
+    assert np.isnan(matrix[[1, 3, 4]]).all()
+
+def test_total_harmonic_distortion():
+    """Checks THD values, including rows with no fundamental."""
+    matrix = np.array([[3 + 4j, 3, 4j], [0, 1, 1]])
+    assert list(harmonics.total_harmonic_distortion(matrix)) == [1.0, 0.0]
+
+def test_extract_features():
+    """Checks the column layout of the extracted features."""
+    matrix = harmonics.parse_harmonics_matrix(['1,0;0,2;', '0,1;'])
+    features = harmonics.extract_harmonic_features(matrix, ['magnitude', 'thd', 'phase'], 3)
+    assert features.shape == (2, harmonics.harmonic_feature_count(['magnitude', 'thd', 'phase'], 3))
+    assert list(features[0, :4]) == [1.0, 2.0, 0.0, 2.0]
+    assert np.isclose(features[1, 4], np.pi / 2)
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Tests for the logservice event archive."""
+
+import datetime
+import os
+import tempfile
+import numpy as np
+from nose.tools import raises
+from energy_sensors.lib.filelock import try_lock
+from energy_sensors.logservice.db import EventLog
+from energy_sensors.logservice.retention import CompactionWorker, EventArchive, compact_events
+from eventfixtures import DAY, make_events, store_events, temp_database
+
+def _stored_ids(router):
+    session = router.sessionmakers[0]()
+    ids = [event_id for event_id, in session.query(EventLog.id).order_by(EventLog.id)]
+    session.close()
+    return ids
+
+class _FailingArchive(EventArchive):
+    """Archive that fails every write, as if the process was interrupted while archiving."""
+
+    def write_segment(self, day, events):
+        raise IOError('Simulated failure.')
+
+def test_segment_roundtrip():
+    """Checks if archived columns are read back without losing data."""
+    with tempfile.TemporaryDirectory() as archive_path:
+        archive = EventArchive(archive_path)
+        archive.write_segment(DAY, make_events([1, 2]))
+        columns = archive.load_segment(DAY)
+        assert list(columns['id']) == [1, 2]
+        assert columns['fft_harmonics'][0] == '9748,2712;46,6;303,-792;'
+        assert columns['reported_time_utc'][0] == np.datetime64('2016-10-04T16:47:50')
+        assert archive.segments() == [{'day': '2016-10-04', 'count': 2, 'min_id': 1, 'max_id': 2}]
+
+def test_segment_mmap():
+    """Checks if clustering columns are memory-mapped."""
+    with tempfile.TemporaryDirectory() as archive_path:
+        archive = EventArchive(archive_path)
+        archive.write_segment(DAY, make_events([1]))
+        columns = archive.load_segment(DAY, mmap=True)
+        assert isinstance(columns['power_active_w'], np.memmap)
+        assert columns['current_peaks'].shape == (1, 3)
+
+def test_segment_merge_skips_archived():
+    """Checks if rewriting already archived events doesn't duplicate them."""
+    with tempfile.TemporaryDirectory() as archive_path:
+        archive = EventArchive(archive_path)
+        archive.write_segment(DAY, make_events([1, 2]))
+        archive.write_segment(DAY, make_events([2, 3]))
+        assert list(archive.load_segment(DAY)['id']) == [1, 2, 3]
+        assert archive.segments()[0]['count'] == 3
+
+def test_compact_events_archives_old_days():
+    """Checks that events before the cutoff are moved to one segment per day."""
+    with temp_database() as (router, temp_dir):
+        store_events(router, make_events([1, 2], datetime.datetime(2016, 10, 3, 23, 59)) +
+                     make_events([3], datetime.datetime(2016, 10, 4, 0, 0)) +
+                     make_events([4], datetime.datetime(2016, 10, 5, 12, 0)))
+        archive = EventArchive(os.path.join(temp_dir, 'archive'))
+        session = router.sessionmakers[0]()
+        assert compact_events(session, archive, datetime.datetime(2016, 10, 5)) == 3
+        session.close()
+        assert _stored_ids(router) == [4]
+        assert [(s['day'], s['count']) for s in archive.segments()] == \
+               [('2016-10-03', 2), ('2016-10-04', 1)]
+
+@raises(IOError)
+def test_compact_events_keeps_rows_until_archived():
+    """Checks that events are never deleted from the database if archiving them fails."""
+    with temp_database() as (router, temp_dir):
+        store_events(router, make_events([1, 2]))
+        session = router.sessionmakers[0]()
+        try:
+            compact_events(session, _FailingArchive(os.path.join(temp_dir, 'archive')),
+                           datetime.datetime(2016, 10, 5))
+        finally:
+            session.close()
+            assert _stored_ids(router) == [1, 2]
+
+def test_compact_events_resumes_interrupted_run():
+    """Checks that events archived right before an interruption aren't archived twice."""
+    with temp_database() as (router, temp_dir):
+        store_events(router, make_events([1, 2, 3]))
+        archive = EventArchive(os.path.join(temp_dir, 'archive'))
+        # the previous run stopped after writing part of the day, before deleting any row
+        archive.write_segment(DAY, make_events([1, 2]))
+        session = router.sessionmakers[0]()
+        assert compact_events(session, archive, datetime.datetime(2016, 10, 5)) == 3
+        session.close()
+        assert _stored_ids(router) == []
+        assert list(archive.load_segment(DAY)['id']) == [1, 2, 3]
+
+def test_compaction_worker_uses_retention_window():
+    """Checks that the worker only archives days older than the retention window."""
+    with temp_database() as (router, temp_dir):
+        store_events(router, make_events([1], datetime.datetime(2016, 10, 3, 12, 0)) +
+                     make_events([2], datetime.datetime(2016, 10, 4, 12, 0)))
+        archive = EventArchive(os.path.join(temp_dir, 'archive'))
+        worker = CompactionWorker(archive, retention_days=1, router=router)
+        assert worker.compact(now=datetime.datetime(2016, 10, 5, 8, 0)) == 1
+        assert _stored_ids(router) == [2]
+
+def test_compaction_worker_skips_when_locked():
+    """Checks that compaction doesn't run while another process holds the archive lock."""
+    with temp_database() as (router, temp_dir):
+        store_events(router, make_events([1]))
+        archive = EventArchive(os.path.join(temp_dir, 'archive'))
+        lock_file = try_lock(archive.lock_path)
+        try:
+            worker = CompactionWorker(archive, retention_days=1, router=router)
+            assert worker.compact(now=datetime.datetime(2016, 10, 10)) == 0
+        finally:
+            lock_file.close()
+        assert _stored_ids(router) == [1]
+        assert archive.segments() == []
+
+def test_load_mapped_segments_most_recent():
+    """Checks that loading history can be limited to the most recent segments."""
+    with tempfile.TemporaryDirectory() as archive_path:
+        archive = EventArchive(archive_path)
+        archive.write_segment(DAY, make_events([1]))
+        archive.write_segment(DAY + datetime.timedelta(days=1), make_events([2]))
+        assert [list(s['id']) for s in archive.load_mapped_segments(1)] == [[2]]
+        assert len(archive.load_mapped_segments()) == 2
+        assert archive.load_mapped_segments(0) == []
@@ -0,0 +1,29 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Tests for the logservice startup modes."""
+
+import os
+import subprocess
+import sys
+import tempfile
+
+_NUMERIC_MODULES = ('numpy', 'scipy', 'sklearn')
+
+def _imported_numeric_modules(settings):
+    """Imports logservice on a fresh interpreter, returning the numeric modules it loaded."""
+    code = ('import sys, energy_sensors.logservice.logservice\n'
+            'print(" ".join(m for m in {!r} if m in sys.modules))'.format(_NUMERIC_MODULES))
+    with tempfile.NamedTemporaryFile('w', suffix='.py') as settings_file:
+        settings_file.write(settings)
+        settings_file.flush()
+        env = dict(os.environ, LOGSERVICE_SETTINGS=settings_file.name)
+        output = subprocess.check_output([sys.executable, '-c', code], env=env)
+    return output.decode('utf-8').split()
+
+def test_ingest_only_skips_numeric_imports():
+    """Checks that ingest-only workers don't import any numeric library."""
+    assert _imported_numeric_modules('INGEST_ONLY = True\n') == []
+
+def test_default_defers_sklearn_import():
+    """Checks that sklearn is only imported when clustering runs."""
+    assert 'sklearn' not in _imported_numeric_modules('')